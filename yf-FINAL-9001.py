@@ -1,11 +1,16 @@
-import yfinance as yf
 import pandas as pd
 import streamlit as st
 import base64
+import mimetypes
 from io import BytesIO
 from PIL import Image
-import math
+import os
+import shutil
 import logging # Use logging for cleaner error/info messages
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import diskcache
 
 # --- Configuration ---
 # Use logging instead of just print/st.error for more structured output
@@ -14,7 +19,20 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 # Constants for file paths and default values
 LOGO_PATH = "ppl_logo.jpg"
 BACKGROUND_PATH = "wp.jpg"
+# Served by Streamlit at app/static/ (enableStaticServing in .streamlit/config.toml); must sit next to this script
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
 DEFAULT_TICKERS = "GOOGL,AAPL,MSFT,AMZN" # Example default tickers
+DEFAULT_MAX_WORKERS = 8 # Parallel yfinance downloads (network-bound, so threads overlap the waiting)
+MAX_WORKERS_LIMIT = 32 # Upper bound of the parallel downloads slider; the rate limiter keeps the request rate in check
+YAHOO_REQUESTS_PER_SECOND = 10 # Sustained request rate shared by all workers, to stay clear of HTTP 429s
+YAHOO_REQUEST_BURST = 20 # Requests allowed back-to-back before the rate limit applies
+CACHE_DIR = ".cache" # On-disk cache of raw yfinance responses, shared across sessions and restarts
+DEFAULT_CACHE_TTL_DAYS = 1 # Fundamentals change at most quarterly; the sidebar allows up to MAX_CACHE_TTL_DAYS
+MAX_CACHE_TTL_DAYS = 90 # Longest disk cache window the sidebar offers; entries are dropped after this regardless
+MEMORY_CACHE_TTL_SECONDS = 3600 # In-process cache of processed results
+MEMORY_CACHE_MAX_ENTRIES = 512 # Tickers kept in the in-process cache; oldest are evicted first
+EXPORT_CACHE_MAX_ENTRIES = 4 # Generated download files kept in memory per format; each can be several MB
+CATEGORICAL_COLUMNS = ['Currency', 'Financial_Currency', 'Sector', 'Industry', 'Country'] # Few distinct values; 'Ticker' gets its own dtype
 FINANCIAL_COLUMNS_TO_SELECT = [
     # Profile Info (Merged)
     'Ticker', 'LongName', 'Long_Business_Summary', 'Country', 'Sector', 'Industry',
@@ -28,19 +46,43 @@ FINANCIAL_COLUMNS_TO_SELECT = [
     'Operating Income', 'EBIT', 'Normalized EBITDA', # EBIT/EBITDA might not always be directly available or need calculation
     'Net Income'
 ]
+FINANCIAL_COLUMNS_SET = frozenset(FINANCIAL_COLUMNS_TO_SELECT) # For membership tests; the list keeps the display order
 
 # --- Helper Functions ---
 
-def set_background(image_file: str):
-    """Sets the background image for the Streamlit app."""
-    try:
+@st.cache_data(show_spinner=False)
+def build_background_css(image_file: str) -> str:
+    """
+    Builds the app's CSS with the background image.
+
+    The CSS is sent to the browser on every rerun, so when static serving is
+    enabled the image is copied into STATIC_DIR (on first use) and referenced by
+    URL, which the browser downloads once and caches. Otherwise, or if the copy
+    can't be made, the image is inlined as a data URI instead. The CSS only depends on the image path, so it is cached: reruns
+    reuse the finished string instead of re-reading, re-encoding and re-formatting it.
+    """
+    image_name = os.path.basename(image_file)
+    static_path = os.path.join(STATIC_DIR, image_name)
+    static_serving = st.get_option("server.enableStaticServing")
+    if static_serving and not os.path.isfile(static_path):
+        try:
+            os.makedirs(STATIC_DIR, exist_ok=True)
+            shutil.copyfile(image_file, static_path)
+        except OSError as e:
+            logging.warning(f"Could not copy '{image_file}' to {STATIC_DIR}, inlining it instead: {e}")
+
+    if static_serving and os.path.isfile(static_path):
+        image_url = f"app/static/{image_name}"
+    else:
         with open(image_file, "rb") as file:
             encoded_string = base64.b64encode(file.read()).decode()
-        st.markdown(
+        mime_type = mimetypes.guess_type(image_file)[0] or 'image/png'
+        image_url = f"data:{mime_type};base64,{encoded_string}"
+    return (
             f"""
             <style>
             .stApp {{
-                background-image: url(data:image/png;base64,{encoded_string});
+                background-image: url({image_url});
                 background-size: cover;
                 background-repeat: no-repeat;
                 background-attachment: fixed; /* Keeps background fixed during scroll */
@@ -76,9 +118,19 @@ def set_background(image_file: str):
                  border-radius: 5px;
             }}
             </style>
-            """,
-            unsafe_allow_html=True
-        )
+            """
+    )
+
+@st.cache_resource
+def load_logo(image_file: str) -> Image.Image:
+    """Opens and decodes the logo once per process; the image is only read, so sessions can share it."""
+    with Image.open(image_file) as image:
+        return image.copy() # Forces the decode and releases the file handle
+
+def set_background(image_file: str):
+    """Sets the background image for the Streamlit app."""
+    try:
+        st.markdown(build_background_css(image_file), unsafe_allow_html=True)
         logging.info(f"Background image '{image_file}' set successfully.")
     except FileNotFoundError:
         st.error(f"Background image file not found: {image_file}")
@@ -87,31 +139,125 @@ def set_background(image_file: str):
         st.error(f"Error setting background: {e}")
         logging.error(f"Error setting background: {e}")
 
-def get_financial_data(ticker: str) -> pd.DataFrame:
+class RateLimiter:
+    """Thread-safe token bucket: allows `burst` requests at once, refilled at `rate_per_second`."""
+
+    def __init__(self, rate_per_second: float, burst: int):
+        self.rate_per_second = rate_per_second
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Blocks until another request may be sent."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate_per_second)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_seconds = (1 - self.tokens) / self.rate_per_second
+            time.sleep(wait_seconds)
+
+@st.cache_resource
+def get_rate_limiter() -> RateLimiter:
+    """Creates one limiter per process, since Yahoo rate-limits per client, not per session."""
+    return RateLimiter(YAHOO_REQUESTS_PER_SECOND, YAHOO_REQUEST_BURST)
+
+@st.cache_resource(show_spinner=False)
+def get_yfinance_module(force_refresh: bool = False):
+    """
+    Imports yfinance on first use, so page loads and fully cached extractions
+    never pay for it (it pulls in requests, lxml, etc.).
+
+    Returns yfinance_cache, a drop-in wrapper with persistent, invalidation-aware
+    caching (pip install yfinance-cache), when it is installed, and plain
+    yfinance otherwise or when force_refresh asks to bypass its cache.
+    """
+    if not force_refresh:
+        try:
+            import yfinance_cache
+            return yfinance_cache
+        except ImportError:
+            pass
+    import yfinance
+    return yfinance
+
+@st.cache_resource
+def get_disk_cache() -> diskcache.Cache:
+    """Opens the on-disk yfinance cache once per process."""
+    return diskcache.Cache(CACHE_DIR)
+
+def load_ticker_field(ticker: str, stock, field: str, cache_ttl_days: int, force_refresh: bool = False):
+    """
+    Returns a yfinance Ticker attribute (e.g. 'info', 'financials'), reading it
+    from the disk cache when a copy younger than cache_ttl_days exists.
+
+    Args:
+        ticker: The stock ticker symbol, used as the cache key.
+        stock: The yfinance (or yfinance_cache) Ticker object.
+        field: Name of the attribute to load.
+        cache_ttl_days: How long a downloaded value stays valid. 0 bypasses the disk cache.
+            Checked against the download time on every read, so lowering it applies to existing entries too.
+        force_refresh: Ignore any cached copy and overwrite it with a fresh download.
+    """
+    if cache_ttl_days <= 0:
+        get_rate_limiter().acquire()
+        return getattr(stock, field)
+
+    cache = get_disk_cache()
+    key = (ticker, field)
+    entry = None if force_refresh else cache.get(key)
+    if isinstance(entry, tuple): # (downloaded_at, value)
+        downloaded_at, value = entry
+        if time.time() - downloaded_at <= cache_ttl_days * 24 * 60 * 60:
+            return value
+
+    get_rate_limiter().acquire() # Only actual downloads count against Yahoo's limit
+    value = getattr(stock, field)
+    # yfinance swallows download errors (e.g. rate limits) and returns an empty frame/dict,
+    # so empty values aren't stored; otherwise a failure would be served for days
+    is_empty = value.empty if isinstance(value, pd.DataFrame) else not value
+    if not is_empty:
+        # The entry's age is checked on read; expire only bounds how long an unread entry stays on disk
+        cache.set(key, (time.time(), value), expire=MAX_CACHE_TTL_DAYS * 24 * 60 * 60)
+    return value
+
+def build_financial_rows(ticker: str, info: dict, financials: pd.DataFrame, q_financials: pd.DataFrame) -> tuple[list[dict], list[tuple[str, str]]]:
     """
-    Fetches annual and TTM financial data for a given stock ticker using yfinance.
+    Builds annual and TTM financial rows from already-downloaded yfinance data.
+
+    Safe to call from worker threads: it never calls Streamlit directly. Messages
+    meant for the user are returned as (level, message) notices instead, where
+    level is the name of the Streamlit call to use ('warning' or 'info').
 
     Args:
         ticker: The stock ticker symbol (e.g., "AAPL").
+        info: The ticker's yfinance info dict (used for currencies).
+        financials: Annual income statement (yfinance `financials`).
+        q_financials: Quarterly income statement (yfinance `quarterly_financials`).
 
     Returns:
-        A pandas DataFrame containing financial data, including a TTM row.
-        Returns a DataFrame with only the 'Ticker' column if an error occurs.
+        A tuple of (rows, notices). Rows are one dict per period, TTM first,
+        so the caller can build a single DataFrame across all tickers.
+        Rows is empty if an error occurs.
     """
+    notices = []
     try:
-        logging.info(f"Fetching financial data for {ticker}...")
-        stock = yf.Ticker(ticker)
-        info = stock.info # Fetch info once
-
         # --- Annual Data ---
-        financials = stock.financials
         if financials.empty:
-            st.warning(f"No annual financial data found for {ticker}.")
-            return pd.DataFrame({'Ticker': [ticker]})
+            notices.append(('warning', f"No annual financial data found for {ticker}."))
+            return [], notices
 
-        df = financials.T.copy() # Transpose for years as rows
+        df = financials.T # Transpose for years as rows (only new columns are added below, so no defensive copy)
         df['Ticker'] = ticker
-        df['Full_Date'] = pd.to_datetime(df.index).strftime('%Y-%m-%d') # Format date
+        # Format date. yfinance already returns period ends as Timestamps, so parsing is only a fallback,
+        # with an explicit format to stay on the fast path (unparseable labels become NaT instead of raising)
+        period_ends = df.index if isinstance(df.index, pd.DatetimeIndex) else pd.to_datetime(df.index, format='ISO8601', errors='coerce')
+        df['Full_Date'] = period_ends.strftime('%Y-%m-%d')
         df = df.reset_index(drop=True)
         df['Year_Index'] = df.index + 1 # Annual rows start from 1
 
@@ -120,7 +266,6 @@ def get_financial_data(ticker: str) -> pd.DataFrame:
         df['Financial_Currency'] = info.get('financialCurrency', 'N/A')
 
         # --- TTM Data ---
-        q_financials = stock.quarterly_financials
         ttm_data = {'Ticker': ticker, 'Full_Date': "TTM", 'Year_Index': 0}
         ttm_data['Currency'] = info.get('currency', 'N/A')
         ttm_data['Financial_Currency'] = info.get('financialCurrency', 'N/A')
@@ -128,48 +273,44 @@ def get_financial_data(ticker: str) -> pd.DataFrame:
         if not q_financials.empty and q_financials.shape[1] >= 4:
             # Sum the latest four quarters for TTM
             ttm_series = q_financials.iloc[:, :4].sum(axis=1, numeric_only=True)
-            # Include only metrics present in the annual data columns
-            common_metrics = df.columns.intersection(ttm_series.index)
-            for metric in common_metrics:
-                 if metric not in ttm_data: # Avoid overwriting Ticker, Date etc.
-                    ttm_data[metric] = ttm_series.get(metric) # Use .get for safety
+            # Include only metrics present in the annual data columns, in one vectorized lookup.
+            # Index set operations also exclude the keys already set (Ticker, Date etc.) so they are never overwritten.
+            common_metrics = df.columns.intersection(ttm_series.index).difference(list(ttm_data), sort=False)
+            ttm_data.update(ttm_series.reindex(common_metrics).to_dict())
         else:
-            st.info(f"Insufficient quarterly data to calculate TTM for {ticker}. TTM financial values set to None.")
-            # Set financial metrics to None if TTM cannot be calculated
-            financial_metrics = [col for col in df.columns if col not in ['Ticker', 'Full_Date', 'Year_Index', 'Currency', 'Financial_Currency']]
-            for metric in financial_metrics:
-                ttm_data[metric] = None
+            notices.append(('info', f"Insufficient quarterly data to calculate TTM for {ticker}. TTM financial values set to None."))
+            # Set financial metrics (the annual line items) to None if TTM cannot be calculated
+            ttm_data.update(dict.fromkeys(financials.index))
 
-        ttm_df = pd.DataFrame([ttm_data])
+        # Combine TTM and annual rows (TTM first) without building per-ticker DataFrames
+        rows = [ttm_data] + df.to_dict('records')
 
-        # Combine TTM and annual data
-        final_df = pd.concat([ttm_df, df], ignore_index=True, sort=False) # Ensure TTM is first
-
-        logging.info(f"Successfully fetched financial data for {ticker}.")
-        return final_df
+        logging.info(f"Successfully processed financial data for {ticker}.")
+        return rows, notices
 
     except Exception as e:
-        st.warning(f"Error getting financial data for {ticker}: {e}")
+        notices.append(('warning', f"Error getting financial data for {ticker}: {e}"))
         logging.warning(f"Error getting financial data for {ticker}: {e}")
-        # Return a minimal DataFrame to allow merging later
-        return pd.DataFrame({'Ticker': [ticker]})
+        return [], notices
 
-def get_profile_data(ticker: str) -> pd.DataFrame:
+def build_profile_row(ticker: str, info: dict) -> tuple[dict | None, list[tuple[str, str]]]:
     """
-    Fetches company profile data for a given stock ticker using yfinance.
+    Builds company profile data from a ticker's yfinance info dict.
+
+    Like build_financial_rows, user-facing messages are returned as notices
+    rather than sent to Streamlit, so this can run in a worker thread.
 
     Args:
         ticker: The stock ticker symbol (e.g., "AAPL").
+        info: The ticker's yfinance info dict.
 
     Returns:
-        A pandas DataFrame containing profile data.
-        Returns a DataFrame with only the 'Ticker' column if an error occurs.
+        A tuple of (row, notices). The row is a dict of profile data, so the
+        caller can build one DataFrame across all tickers. It is None if an
+        error occurs.
     """
+    notices = []
     try:
-        logging.info(f"Fetching profile data for {ticker}...")
-        stock = yf.Ticker(ticker)
-        info = stock.info
-
         # Use .get() with default values for robustness
         company_info = {
             'Ticker': ticker,
@@ -186,28 +327,112 @@ def get_profile_data(ticker: str) -> pd.DataFrame:
         company_info['Full_Time_Employees'] = str(company_info['Full_Time_Employees']) if company_info['Full_Time_Employees'] != 'N/A' else 'N/A'
 
 
-        logging.info(f"Successfully fetched profile data for {ticker}.")
-        return pd.DataFrame([company_info])
+        logging.info(f"Successfully processed profile data for {ticker}.")
+        return company_info, notices
 
     except Exception as e:
-        st.warning(f"Error getting profile data for {ticker}: {e}")
+        notices.append(('warning', f"Error getting profile data for {ticker}: {e}"))
         logging.warning(f"Error getting profile data for {ticker}: {e}")
-        # Return a minimal DataFrame to allow merging later
-        return pd.DataFrame({'Ticker': [ticker]})
+        return None, notices
+
+def download_ticker_data(ticker: str, cache_ttl_days: int = DEFAULT_CACHE_TTL_DAYS, force_refresh: bool = False) -> tuple[dict | None, list[dict], list[tuple[str, str]]]:
+    """
+    Fetches profile and financial data for one ticker. Runs in a worker thread.
+
+    A single yf.Ticker is used and its `info` is downloaded once, then shared
+    by the profile and financial builders. The raw yfinance responses are cached
+    on disk for cache_ttl_days; fetch_ticker_data adds the in-memory cache.
+
+    Args:
+        ticker: The stock ticker symbol (e.g., "AAPL").
+        cache_ttl_days: Disk cache lifetime passed to load_ticker_field.
+        force_refresh: Bypass the disk and yfinance_cache layers and download fresh data.
+
+    Returns:
+        A tuple of (profile row, financial rows, notices).
+
+    Raises:
+        Exception: Download errors (timeouts, rate limits) are raised rather than
+            returned, because st.cache_data doesn't cache exceptions: the next
+            extraction retries the ticker instead of getting the failure from memory.
+    """
+    logging.info(f"Fetching data for {ticker}...")
+    yf = get_yfinance_module(force_refresh)
+    stock = yf.Ticker(ticker)
+    info = load_ticker_field(ticker, stock, 'info', cache_ttl_days, force_refresh) # Fetch info once for both builders
+    financials = load_ticker_field(ticker, stock, 'financials', cache_ttl_days, force_refresh)
+    q_financials = load_ticker_field(ticker, stock, 'quarterly_financials', cache_ttl_days, force_refresh)
+
+    profile_row, profile_notices = build_profile_row(ticker, info)
+    financial_rows, financial_notices = build_financial_rows(ticker, info, financials, q_financials)
+    return profile_row, financial_rows, profile_notices + financial_notices
+
+@st.cache_data(ttl=MEMORY_CACHE_TTL_SECONDS, max_entries=MEMORY_CACHE_MAX_ENTRIES, show_spinner=False)
+def fetch_ticker_data(ticker: str, cache_ttl_days: int = DEFAULT_CACHE_TTL_DAYS, force_refresh: bool = False) -> tuple[dict | None, list[dict], list[tuple[str, str]]]:
+    """
+    download_ticker_data, cached in memory for MEMORY_CACHE_TTL_SECONDS (up to MEMORY_CACHE_MAX_ENTRIES tickers).
+
+    Concurrent calls with the same arguments (from any session) wait for one
+    computation, as st.cache_data locks each key on a miss. Callers forcing a
+    refresh should clear this cache first.
+    """
+    return download_ticker_data(ticker, cache_ttl_days, force_refresh)
+
+@st.cache_data(ttl=MEMORY_CACHE_TTL_SECONDS, max_entries=EXPORT_CACHE_MAX_ENTRIES, show_spinner=False)
+def create_excel_download(sheets: dict[str, pd.DataFrame], filename: str) -> bytes:
+    """
+    Creates an Excel file in memory for downloading, with one sheet per DataFrame.
+
+    All sheets go into a single workbook written in one pass. It uses
+    xlsxwriter's constant_memory mode, which flushes each row once it is
+    complete instead of holding the whole sheet in RAM. That mode only works
+    when rows are written in order, and pandas' to_excel writes column by
+    column, so the rows are written here directly.
+
+    Cached on the DataFrames' contents, so reruns that don't change the data
+    reuse the bytes instead of rebuilding the workbook.
+    """
+    import xlsxwriter # Imported on first use, so sessions that never download don't load it
+
+    output = BytesIO()
+    # nan_inf_to_errors writes +/-inf as Excel error cells instead of raising and failing the whole file
+    workbook = xlsxwriter.Workbook(output, {'constant_memory': True, 'nan_inf_to_errors': True})
+    header_format = workbook.add_format({'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'}) # Same header style as to_excel
+
+    for sheet_name, df in sheets.items():
+        worksheet = workbook.add_worksheet(sheet_name)
+        worksheet.write_row(0, 0, [str(col) for col in df.columns], header_format)
+        for row_idx, row in enumerate(df.itertuples(index=False, name=None), start=1):
+            # Missing values become empty cells (xlsxwriter rejects NaN)
+            worksheet.write_row(row_idx, 0, [None if pd.isna(value) else value for value in row])
+
+    workbook.close()
+    return output.getvalue()
+
+@st.cache_data(ttl=MEMORY_CACHE_TTL_SECONDS, max_entries=EXPORT_CACHE_MAX_ENTRIES, show_spinner=False)
+def create_parquet_download(df: pd.DataFrame) -> bytes:
+    """Creates a zstd-compressed Parquet file in memory. Much smaller and faster to write than Excel."""
+    output = BytesIO()
+    df.to_parquet(output, index=False, compression='zstd')
+    return output.getvalue()
 
-def create_excel_download(df: pd.DataFrame, filename: str) -> bytes:
-    """Creates an Excel file in memory for downloading."""
+@st.cache_data(ttl=MEMORY_CACHE_TTL_SECONDS, max_entries=EXPORT_CACHE_MAX_ENTRIES, show_spinner=False)
+def create_csv_download(df: pd.DataFrame) -> bytes:
+    """Creates a gzip-compressed CSV file in memory. Streams rows as it writes and opens in any spreadsheet tool."""
     output = BytesIO()
-    # Use ExcelWriter to potentially add more sheets or formatting later
-    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-        df.to_excel(writer, index=False, sheet_name='Data')
-        # Optional: Auto-adjust column widths (can be slow for large data)
-        # worksheet = writer.sheets['Data']
-        # for i, col in enumerate(df.columns):
-        #     column_len = max(df[col].astype(str).map(len).max(), len(col)) + 2
-        #     worksheet.set_column(i, i, column_len)
+    df.to_csv(output, index=False, compression='gzip')
     return output.getvalue()
 
+def consume_force_refresh():
+    """
+    Extract button callback: moves the force refresh checkbox into
+    'force_refresh_requested' for this extraction and unticks it, so the
+    refresh (which also clears the shared memory cache) happens only once.
+    Callbacks run before the script, the only point where a widget's value can be changed.
+    """
+    st.session_state.force_refresh_requested = st.session_state.force_refresh_checkbox
+    st.session_state.force_refresh_checkbox = False
+
 # --- Streamlit App ---
 
 # Page Configuration (do this first)
@@ -225,8 +450,7 @@ col_logo, col_title = st.columns([1, 5]) # Adjust ratio as needed
 
 with col_logo:
     try:
-        logo = Image.open(LOGO_PATH)
-        st.image(logo, width=120) # Slightly larger logo
+        st.image(load_logo(LOGO_PATH), width=120) # Slightly larger logo
     except FileNotFoundError:
         st.error(f"Logo image not found: {LOGO_PATH}")
         logging.error(f"Logo image not found: {LOGO_PATH}")
@@ -250,6 +474,21 @@ if 'processed_data' not in st.session_state:
 if 'all_extracted_data' not in st.session_state:
     st.session_state.all_extracted_data = pd.DataFrame()
 
+# --- Sidebar: Cache Settings ---
+with st.sidebar:
+    st.subheader("Cache Settings")
+    cache_ttl_days = st.slider(
+        "Keep downloaded Yahoo data on disk (days)",
+        0, MAX_CACHE_TTL_DAYS, DEFAULT_CACHE_TTL_DAYS,
+        key="cache_ttl_slider",
+        help="Repeated extractions reuse data downloaded within this window. Set to 0 to always download fresh data."
+    )
+    force_refresh = st.checkbox(
+        "Force refresh from Yahoo",
+        value=False,
+        key="force_refresh_checkbox",
+        help="Ignore all cached data on the next extraction and download fresh copies. Unticks itself once used."
+    )
 
 # --- Ticker Input Area ---
 st.subheader("1. Enter Stock Tickers")
@@ -279,18 +518,20 @@ if st.session_state.tickers:
     st.markdown("---")
     st.subheader("2. Configure and Extract Data")
 
-    # Batch size selection (optional, consider removing if not strictly needed or if ticker list is usually small)
-    # max_tickers_per_batch = st.slider(
-    #     "Select maximum tickers per processing batch (if needed)",
-    #     1, len(st.session_state.tickers),
-    #     min(10, len(st.session_state.tickers)), # Default to 10 or total, whichever is smaller
-    #     key="batch_slider"
-    # )
-    # num_batches = math.ceil(len(st.session_state.tickers) / max_tickers_per_batch)
-
-    if st.button("Extract Financial Data", key="extract_data_button"):
-        all_financial_dfs = []
-        all_profile_dfs = []
+    max_workers = st.slider(
+        "Parallel downloads",
+        1, MAX_WORKERS_LIMIT, DEFAULT_MAX_WORKERS,
+        key="workers_slider",
+        help=f"Number of tickers fetched from Yahoo Finance at the same time. Requests are capped at {YAHOO_REQUESTS_PER_SECOND}/s overall."
+    )
+
+    if st.button("Extract Financial Data", key="extract_data_button", on_click=consume_force_refresh):
+        force_refresh = st.session_state.force_refresh_requested # The checkbox itself was just unticked
+        if force_refresh:
+            fetch_ticker_data.clear() # Drop in-memory results so every ticker is downloaded again
+
+        all_financial_rows = []
+        all_profile_rows = []
         failed_tickers = []
         total_tickers_to_process = len(st.session_state.tickers)
 
@@ -298,37 +539,54 @@ if st.session_state.tickers:
         progress_bar = st.progress(0)
         status_text = st.empty() # Placeholder for status updates
 
-        # Process all tickers in one go (removed batching for simplicity unless necessary)
-        for i, ticker in enumerate(st.session_state.tickers):
-            status_text.text(f"Processing {ticker} ({i+1}/{total_tickers_to_process})...")
-
-            profile_df = get_profile_data(ticker)
-            financial_df = get_financial_data(ticker)
-
-            # Check if data fetching was successful (minimal df indicates failure)
-            if len(profile_df.columns) > 1: # More than just 'Ticker'
-                 all_profile_dfs.append(profile_df)
+        # Fetch tickers concurrently (each ticker once, even if entered twice). Workers only talk to
+        # yfinance; all Streamlit calls stay on this (the script) thread as results come back.
+        unique_tickers = list(dict.fromkeys(st.session_state.tickers))
+        fetched = {}
+        all_notices = [] # Shown together once the loop is done, so it isn't slowed by widget updates
+        # Never start more threads than there are tickers to keep busy
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(unique_tickers))) as executor:
+            fetch = download_ticker_data if cache_ttl_days == 0 else fetch_ticker_data # A TTL of 0 skips the memory cache too
+            futures = {executor.submit(fetch, ticker, cache_ttl_days, force_refresh): ticker for ticker in unique_tickers}
+            for i, future in enumerate(as_completed(futures)):
+                ticker = futures[future]
+                try:
+                    profile_row, financial_rows, notices = future.result()
+                except Exception as e:
+                    logging.warning(f"Error getting data for {ticker}: {e}")
+                    profile_row, financial_rows, notices = None, [], [('warning', f"Error getting data for {ticker}: {e}")]
+                fetched[ticker] = (profile_row, financial_rows)
+                all_notices.extend(notices)
+
+                status_text.text(f"Processed {ticker} ({i+1}/{len(unique_tickers)})...")
+                progress_bar.progress((i + 1) / len(unique_tickers))
+
+        # Collect results in the order the tickers were entered (once per ticker, even if entered twice)
+        for ticker in unique_tickers:
+            profile_row, financial_rows = fetched[ticker]
+
+            # Check if data fetching was successful (no row indicates failure)
+            if profile_row:
+                 all_profile_rows.append(profile_row)
             else:
                  failed_tickers.append(f"{ticker} (profile)")
 
-            if len(financial_df.columns) > 1: # More than just 'Ticker'
-                all_financial_dfs.append(financial_df)
+            if financial_rows:
+                all_financial_rows.extend(financial_rows)
             # No separate else for financial, as profile failure is more critical for merge
             elif f"{ticker} (profile)" not in failed_tickers: # Avoid double counting if profile also failed
                  failed_tickers.append(f"{ticker} (financial)")
 
-
-            # Update progress
-            progress = (i + 1) / total_tickers_to_process
-            progress_bar.progress(progress)
-
         status_text.success(f"Data extraction complete for {total_tickers_to_process} tickers.")
         progress_bar.empty() # Remove progress bar after completion
 
+        for level, message in all_notices:
+            getattr(st, level)(message)
+
         if failed_tickers:
             st.warning(f"Could not retrieve complete data for: {', '.join(failed_tickers)}")
 
-        if not all_profile_dfs or not all_financial_dfs:
+        if not all_profile_rows or not all_financial_rows:
             st.error("No data could be extracted. Please check tickers and network connection.")
             st.session_state.processed_data = pd.DataFrame()
             st.session_state.all_extracted_data = pd.DataFrame()
@@ -337,13 +595,26 @@ if st.session_state.tickers:
             st.markdown("---")
             st.subheader("3. Processed Results")
 
-            # Combine all successfully fetched dataframes
-            combined_profile_df = pd.concat(all_profile_dfs, ignore_index=True)
-            combined_financial_df = pd.concat(all_financial_dfs, ignore_index=True)
-
-            # Merge profile and financial data
-            # Use 'outer' merge to keep tickers even if one part failed, though checks above should minimize this
-            final_df = pd.merge(combined_profile_df, combined_financial_df, on='Ticker', how='inner') # Use 'inner' if both profile and financial are required
+            # Build each table from the collected rows in one construction for all tickers
+            combined_profile_df = pd.DataFrame(all_profile_rows)
+            combined_financial_df = pd.DataFrame(all_financial_rows)
+
+            # Store low-cardinality text columns as categoricals (1-byte codes instead of Python strings).
+            # Both frames share one Ticker dtype, so the isin/map lookups below match on the same categories.
+            ticker_dtype = pd.CategoricalDtype(pd.unique(pd.Series(st.session_state.tickers)))
+            for frame in (combined_profile_df, combined_financial_df):
+                frame['Ticker'] = frame['Ticker'].astype(ticker_dtype)
+                for col in frame.columns.intersection(CATEGORICAL_COLUMNS):
+                    frame[col] = frame[col].astype('category')
+
+            # Broadcast profile data onto the financial rows with Series.map (one profile row per ticker),
+            # instead of a join. Only tickers with both profile and financial data are kept.
+            # map() needs a unique index, so a duplicated profile raises instead of multiplying rows.
+            profile_by_ticker = combined_profile_df.set_index('Ticker')
+            has_profile = combined_financial_df['Ticker'].isin(profile_by_ticker.index)
+            final_df = combined_financial_df[has_profile].reset_index(drop=True)
+            for col in profile_by_ticker.columns:
+                final_df[col] = final_df['Ticker'].map(profile_by_ticker[col])
 
             if final_df.empty:
                 st.error("Data merging resulted in an empty DataFrame. Check fetched data.")
@@ -351,9 +622,6 @@ if st.session_state.tickers:
                 st.session_state.all_extracted_data = pd.DataFrame()
 
             else:
-                # Store the full merged data before selecting columns
-                st.session_state.all_extracted_data = final_df.copy()
-
                 # Select and Order Display Columns
                 # Get columns that actually exist in the merged dataframe
                 existing_display_columns = [col for col in FINANCIAL_COLUMNS_TO_SELECT if col in final_df.columns]
@@ -365,8 +633,13 @@ if st.session_state.tickers:
                 # Create the display dataframe
                 final_display_dt = final_df[existing_display_columns]
 
-                # Store the processed data for display
+                # Reorder columns for the "All Data" sheet/file (display columns first). Done once here
+                # rather than on every rerun; final_df itself is never stored or modified, so no copy.
+                ordered_cols = existing_display_columns + [col for col in final_df.columns if col not in FINANCIAL_COLUMNS_SET]
+
+                # Store the processed data for display, and the full data already in download order
                 st.session_state.processed_data = final_display_dt
+                st.session_state.all_extracted_data = final_df[ordered_cols]
 
 # --- Display Results and Download ---
 if not st.session_state.processed_data.empty:
@@ -376,47 +649,49 @@ if not st.session_state.processed_data.empty:
     st.dataframe(st.session_state.processed_data)
 
     # --- Download Buttons ---
+    all_data_ordered = st.session_state.all_extracted_data # Already in download order (display columns first)
+
     col_dl1, col_dl2 = st.columns(2)
 
     with col_dl1:
-        # Download Button for Displayed/Formatted Data
+        # Single workbook holding both the displayed data and all extracted data
         try:
-            excel_display_data = create_excel_download(
-                st.session_state.processed_data,
-                "Pulse_yf_FormattedData.xlsx"
-            )
+            sheets = {'Displayed': st.session_state.processed_data}
+            if not all_data_ordered.empty:
+                sheets['All'] = all_data_ordered
+            excel_data = create_excel_download(sheets, "Pulse_yf_Data.xlsx")
             st.download_button(
-                label="📥 Download Displayed Data (Excel)",
-                data=excel_display_data,
-                file_name='Pulse_yf_FormattedData.xlsx',
+                label="📥 Download Data (Excel: Displayed + All sheets)",
+                data=excel_data,
+                file_name='Pulse_yf_Data.xlsx',
                 mime='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-                key="download_display_button"
+                key="download_excel_button"
             )
         except Exception as e:
-            st.error(f"Error creating displayed data download file: {e}")
-            logging.error(f"Error creating displayed data download file: {e}")
+            st.error(f"Error creating Excel download file: {e}")
+            logging.error(f"Error creating Excel download file: {e}")
 
 
     with col_dl2:
        # Download Button for All Extracted Data
-       if not st.session_state.all_extracted_data.empty:
+       if not all_data_ordered.empty:
             try:
-                # Optional: Reorder columns for the "All Data" file (display columns first)
-                all_cols = st.session_state.all_extracted_data.columns.tolist()
-                ordered_cols = [col for col in FINANCIAL_COLUMNS_TO_SELECT if col in all_cols] + \
-                               [col for col in all_cols if col not in FINANCIAL_COLUMNS_TO_SELECT]
-                all_data_ordered = st.session_state.all_extracted_data[ordered_cols]
-
-                excel_all_data = create_excel_download(
-                    all_data_ordered, # Use the reordered dataframe
-                    "Pulse_yf_AllExtractedData.xlsx"
+                parquet_all_data = create_parquet_download(all_data_ordered)
+                st.download_button(
+                    label="🗜️ Download All Extracted Data (Parquet)",
+                    data=parquet_all_data,
+                    file_name='Pulse_yf_AllExtractedData.parquet',
+                    mime='application/vnd.apache.parquet',
+                    key="download_all_parquet_button"
                 )
+
+                csv_all_data = create_csv_download(all_data_ordered)
                 st.download_button(
-                    label="📦 Download All Extracted Data (Excel)",
-                    data=excel_all_data,
-                    file_name='Pulse_yf_AllExtractedData.xlsx',
-                    mime='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-                    key="download_all_button"
+                    label="📄 Download All Extracted Data (CSV, gzip)",
+                    data=csv_all_data,
+                    file_name='Pulse_yf_AllExtractedData.csv.gz',
+                    mime='application/gzip',
+                    key="download_all_csv_button"
                 )
             except Exception as e:
                  st.error(f"Error creating all data download file: {e}")